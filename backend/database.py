@@ -1,6 +1,8 @@
 """database.py — Async SQLAlchemy engine setup"""
 import os
 from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 
@@ -18,14 +20,38 @@ _connect_args = {}
 if "sqlite" in DATABASE_URL and "aiosqlite" not in DATABASE_URL:
     _connect_args = {"check_same_thread": False}
 
+# Size the pool for bursts of concurrent WebSocket joins (rooms hold up to 200 peers).
+# SQLite engines use a different pool class that does not accept these arguments.
+_pool_args = {}
+if not DATABASE_URL.startswith("sqlite"):
+    _pool_args = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "20")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "40")),
+        "pool_timeout": 10,
+        "pool_recycle": 1800,
+    }
 
 engine = create_async_engine(
     DATABASE_URL,
     echo=False,
     connect_args=_connect_args,
     pool_pre_ping=True,  # Recommended for connection pools
+    query_cache_size=1200,
+    **_pool_args,
 )
 
+if "sqlite" in DATABASE_URL:
+    # WAL lets WebSocket-join reads proceed while a create_room commit is writing;
+    # synchronous=NORMAL is durable under WAL apart from the last txn on power loss.
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.execute("PRAGMA mmap_size=268435456")
+        cur.close()
+
 AsyncSessionLocal = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
@@ -34,8 +60,15 @@ class Base(DeclarativeBase):
 
 
 async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    except DBAPIError:
+        # With several uvicorn workers starting at once, another worker can create
+        # the tables between our existence check and CREATE TABLE. A second pass
+        # sees them and is a no-op; any other error is raised again.
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
 
 
 async def get_db():
@@ -6,45 +6,183 @@ Privacy guarantees:
   - In-memory connection registry is dropped entirely on disconnect.
   - No message content is ever written to the database.
 """
-import json
+import asyncio
+import hashlib
+import hmac
 import logging
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
 from contextlib import asynccontextmanager
-from typing import Any
+from dataclasses import dataclass, field
 
 import bcrypt
+import orjson
+import redis.asyncio as aioredis
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 
-from database import init_db, get_db
+from database import AsyncSessionLocal, init_db, get_db
 from models import Room
-from schemas import RoomCreate, RoomResponse
+from schemas import MAX_PASSWORD_BYTES, RoomCreate, RoomResponse
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("anzen")
 
 
-def hash_password(plain: str) -> str:
-    """Hash a password with bcrypt."""
-    return bcrypt.hashpw(plain.encode(), bcrypt.gensalt(rounds=12)).decode()
+# Cost factor for new hashes. Tune per deploy host so one hash takes ~250ms
+# (see scripts/calibrate_bcrypt.py); existing hashes keep their own cost.
+_BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
 
+# bcrypt is deliberately CPU-heavy; run it off the event loop so a slow hash
+# never stalls signaling for every other connected peer. bcrypt releases the
+# GIL inside its C core, so these threads genuinely run in parallel.
+_bcrypt_pool = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="bcrypt")
 
-def verify_password(plain: str, hashed: str) -> bool:
-    """Verify a password against its bcrypt hash."""
+
+def _hash_password_sync(plain: str) -> str:
+    return bcrypt.hashpw(plain.encode(), bcrypt.gensalt(rounds=_BCRYPT_ROUNDS)).decode()
+
+
+def _verify_password_sync(plain: str, hashed: str) -> bool:
     try:
         return bcrypt.checkpw(plain.encode(), hashed.encode())
     except Exception:
         return False
 
 
+async def hash_password(plain: str) -> str:
+    """Hash a password with bcrypt (in the bcrypt thread pool)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_bcrypt_pool, _hash_password_sync, plain)
+
+
+async def verify_password(plain: str, hashed: str) -> bool:
+    """Verify a password against its bcrypt hash (in the bcrypt thread pool)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_bcrypt_pool, _verify_password_sync, plain, hashed)
+
+
+def _time_bcrypt_hash_ms() -> float:
+    start = time.perf_counter()
+    bcrypt.hashpw(b"x" * 8, bcrypt.gensalt(rounds=_BCRYPT_ROUNDS))
+    return (time.perf_counter() - start) * 1000
+
+
+async def _calibrate_bcrypt():
+    """Time one hash at the configured cost and warn if it is outside 200-400ms."""
+    loop = asyncio.get_running_loop()
+    elapsed_ms = await loop.run_in_executor(_bcrypt_pool, _time_bcrypt_hash_ms)
+    if 200 <= elapsed_ms <= 400:
+        logger.info(f"bcrypt cost {_BCRYPT_ROUNDS}: {elapsed_ms:.0f}ms per hash")
+    else:
+        logger.warning(
+            f"bcrypt cost {_BCRYPT_ROUNDS}: {elapsed_ms:.0f}ms per hash is outside the 200-400ms target; "
+            f"run scripts/calibrate_bcrypt.py and set BCRYPT_ROUNDS accordingly"
+        )
+
+
+# ── Join verification cache ────────────────────────────────────────────────────
+# Clients reconnect often (ICE restarts, tab wake-ups), and each WS join would
+# otherwise pay a full bcrypt compare. Maps room_name -> (hashed_password the
+# digests were verified against, sha256(password) digests that passed bcrypt,
+# expiry timestamp), so plaintext passwords never sit in RAM. An entry is only
+# honoured while the room's current hash matches, so a changed password takes
+# effect as soon as the room cache sees it. Insertion order doubles as the FIFO
+# eviction order.
+_VERIFY_CACHE_TTL = 300.0
+_VERIFY_CACHE_MAX = 10_000
+_verify_cache: dict[str, tuple[str, set[bytes], float]] = {}
+
+
+async def _verify_join_password(room_name: str, password: str, hashed: str) -> bool:
+    """Verify a join password, skipping bcrypt if it was verified recently."""
+    digest = hashlib.sha256(password.encode()).digest()
+    entry = _verify_cache.get(room_name)
+    if entry and (entry[0] != hashed or entry[2] <= time.time()):
+        del _verify_cache[room_name]
+        entry = None
+    if entry and any(hmac.compare_digest(digest, known) for known in entry[1]):
+        return True
+
+    if not await verify_password(password, hashed):
+        return False
+
+    entry = _verify_cache.get(room_name)
+    if entry and entry[0] == hashed:
+        entry[1].add(digest)
+        return True
+    _verify_cache.pop(room_name, None)
+    while len(_verify_cache) >= _VERIFY_CACHE_MAX:
+        del _verify_cache[next(iter(_verify_cache))]
+    _verify_cache[room_name] = (hashed, {digest}, time.time() + _VERIFY_CACHE_TTL)
+    return True
+
+
+async def _purge_verify_cache():
+    """Periodically drop expired verification cache entries."""
+    while True:
+        await asyncio.sleep(_VERIFY_CACHE_TTL / 5)
+        now = time.time()
+        for name in [n for n, (_, _, expires) in _verify_cache.items() if expires <= now]:
+            _verify_cache.pop(name, None)
+
+
+# ── Rate limiting ──────────────────────────────────────────────────────────────
+# Token buckets: each peer may relay _PEER_RATE msgs/s (bursts up to _PEER_BURST)
+# and each source IP may open _IP_RATE connections/s (bursts up to _IP_BURST).
+# _ip_buckets maps host -> (tokens, last refill time). The host is the client
+# address uvicorn reports; behind a proxy, run with --proxy-headers and set
+# FORWARDED_ALLOW_IPS, or every client shares the proxy's bucket.
+_PEER_RATE = float(os.getenv("PEER_MSG_RATE", "200"))
+_PEER_BURST = float(os.getenv("PEER_MSG_BURST", "400"))
+_IP_RATE = float(os.getenv("IP_CONNECT_RATE", "5"))
+_IP_BURST = float(os.getenv("IP_CONNECT_BURST", "20"))
+_ip_buckets: dict[str, tuple[float, float]] = {}
+
+
+def _allow_connection(host: str) -> bool:
+    """Take one token from the host's connect bucket; False if it is empty."""
+    now = time.monotonic()
+    tokens, ts = _ip_buckets.get(host, (_IP_BURST, now))
+    tokens = min(_IP_BURST, tokens + (now - ts) * _IP_RATE)
+    allowed = tokens >= 1
+    _ip_buckets[host] = (tokens - 1 if allowed else tokens, now)
+    return allowed
+
+
+async def _purge_ip_buckets():
+    """Periodically drop buckets that have refilled completely."""
+    while True:
+        await asyncio.sleep(60)
+        now = time.monotonic()
+        full = [h for h, (tokens, ts) in _ip_buckets.items() if tokens + (now - ts) * _IP_RATE >= _IP_BURST]
+        for host in full:
+            _ip_buckets.pop(host, None)
+
+
 # ── Lifespan ───────────────────────────────────────────────────────────────────
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await init_db()
+    await _calibrate_bcrypt()
+    background_tasks = [
+        asyncio.create_task(_purge_verify_cache()),
+        asyncio.create_task(_purge_ip_buckets()),
+        asyncio.create_task(_purge_room_cache()),
+        *await _backplane_start(),
+    ]
     logger.info("Anzen signaling server started.")
     yield
     logger.info("Anzen signaling server shutting down.")
+    for task in background_tasks:
+        task.cancel()
+    await _backplane_stop()
+    _bcrypt_pool.shutdown(wait=False)
 
 
 app = FastAPI(title="Anzen Signaling Server", lifespan=lifespan)
@@ -59,57 +197,426 @@ app.add_middleware(
 
 
 # ── In-memory signaling registry ───────────────────────────────────────────────
-# Structure: { room_name: { peer_id: { ws: WebSocket, username: str, avatarSeed: str } } }
+# Peers are keyed flat by (room_name, peer_id) so routing a message is a single
+# hash lookup. _rooms keeps each room's members as parallel columns, so the
+# "joined" list and broadcasts are plain zips over lists.
 # This is NEVER persisted. It lives only in RAM for the duration of the process.
-rooms_registry: dict[str, dict[str, dict[str, Any]]] = {}
+@dataclass(slots=True)
+class PeerRecord:
+    ws: WebSocket
+    queue: asyncio.Queue
+    writer: asyncio.Task
+    bucket_tokens: float = _PEER_BURST
+    bucket_ts: float = 0.0
+    conn_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    closing: bool = False
+    close_task: asyncio.Task | None = None
+
+
+@dataclass(slots=True)
+class RoomState:
+    peer_ids: list[str] = field(default_factory=list)
+    usernames: list[str] = field(default_factory=list)
+    avatars: list[str] = field(default_factory=list)
+    active: list[bool] = field(default_factory=list)
+    records: list[PeerRecord] = field(default_factory=list)
+
+    def add(self, peer_id: str, username: str, avatar_seed: str, is_active: bool, record: PeerRecord):
+        """Add a peer, replacing any existing entry with the same peer_id."""
+        if peer_id in self.peer_ids:
+            i = self.peer_ids.index(peer_id)
+            self.usernames[i], self.avatars[i], self.active[i], self.records[i] = (
+                username, avatar_seed, is_active, record,
+            )
+            return
+        self.peer_ids.append(peer_id)
+        self.usernames.append(username)
+        self.avatars.append(avatar_seed)
+        self.active.append(is_active)
+        self.records.append(record)
+
+    def remove(self, peer_id: str):
+        i = self.peer_ids.index(peer_id)
+        for column in (self.peer_ids, self.usernames, self.avatars, self.active, self.records):
+            del column[i]
+
+    def set_active(self, peer_id: str, is_active: bool):
+        self.active[self.peer_ids.index(peer_id)] = is_active
+
+    def describe(self) -> list[dict]:
+        return [
+            {"peerId": p, "username": u, "avatarSeed": a, "isActive": s}
+            for p, u, a, s in zip(self.peer_ids, self.usernames, self.avatars, self.active)
+        ]
+
+
+# Outbound frames queued per peer before it counts as stalled and is disconnected.
+_PEER_QUEUE_SIZE = 128
+
+_peers: dict[tuple[str, str], PeerRecord] = {}
+_rooms: dict[str, RoomState] = defaultdict(RoomState)
+
+
+# ── Redis backplane (optional) ─────────────────────────────────────────────────
+# With REDIS_URL set, several server processes can serve the same rooms. Each node
+# subscribes to anzen:room:{name} for the rooms it has local peers in; frames for
+# peers that are not local are published there, and room membership is kept in
+# the anzen:room:{name}:peers hash so joiners see peers on every node. Each hash
+# value carries the owning connection's token, so a stale connection closing after
+# its peer reconnected elsewhere cannot remove (or overwrite) the newer entry.
+# Every node heartbeats anzen:node:{id} with a short TTL; presence entries whose
+# node key has expired belong to a crashed node and are pruned when read.
+# Published frames are <json header>\n<payload>; the header carries the sending
+# node id (so it can skip its own frames) and either a target or excluded peer.
+# Without REDIS_URL everything stays process-local.
+REDIS_URL = os.getenv("REDIS_URL")
+_NODE_ID = uuid.uuid4().hex
+_PRESENCE_TTL = 24 * 3600  # backstop for rooms nobody reads after their node died
+_NODE_TTL = 30
+_NODE_HEARTBEAT = 10
+_redis: aioredis.Redis | None = None
+_pubsub = None
+_publish_queue: asyncio.Queue[tuple[str, bytes]] = asyncio.Queue(maxsize=10_000)
+
+# HDEL / HSET a presence field only while it still belongs to the given connection.
+_PRESENCE_REMOVE_LUA = """
+local v = redis.call('HGET', KEYS[1], ARGV[1])
+if v and cjson.decode(v)['conn'] == ARGV[2] then
+    return redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return 0
+"""
+_PRESENCE_UPDATE_LUA = """
+local v = redis.call('HGET', KEYS[1], ARGV[1])
+if v and cjson.decode(v)['conn'] == ARGV[2] then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[3])
+    return 1
+end
+return 0
+"""
+_presence_remove_script = None
+_presence_update_script = None
+
+
+def _channel(room_name: str) -> str:
+    return f"anzen:room:{room_name}"
+
+
+def _presence_key(room_name: str) -> str:
+    return f"anzen:room:{room_name}:peers"
+
+
+def _node_key(node_id: str) -> str:
+    return f"anzen:node:{node_id}"
+
+
+async def _backplane_start() -> list[asyncio.Task]:
+    """Connect to Redis if configured; returns the backplane's background tasks."""
+    global _redis, _pubsub, _presence_remove_script, _presence_update_script
+    if not REDIS_URL:
+        return []
+    _redis = aioredis.from_url(REDIS_URL)
+    _pubsub = _redis.pubsub()
+    _presence_remove_script = _redis.register_script(_PRESENCE_REMOVE_LUA)
+    _presence_update_script = _redis.register_script(_PRESENCE_UPDATE_LUA)
+    await _redis.set(_node_key(_NODE_ID), 1, ex=_NODE_TTL)
+    logger.info(f"Redis backplane enabled (node {_NODE_ID[:8]})")
+    return [
+        asyncio.create_task(_publisher()),
+        asyncio.create_task(_consumer()),
+        asyncio.create_task(_heartbeat()),
+    ]
+
+
+async def _backplane_stop():
+    if _redis is not None:
+        await _redis.delete(_node_key(_NODE_ID))
+        await _pubsub.aclose()
+        await _redis.aclose()
+
+
+async def _heartbeat():
+    """Keep this node's liveness key alive while the process runs."""
+    while True:
+        await asyncio.sleep(_NODE_HEARTBEAT)
+        try:
+            previous = await _redis.set(_node_key(_NODE_ID), 1, ex=_NODE_TTL, get=True)
+        except Exception as e:
+            logger.warning(f"Redis heartbeat failed: {e!r}")
+            continue
+        if previous is None:
+            # The key lapsed (e.g. a Redis outage), so other nodes may have pruned our
+            # peers as dead. Restore any entry that has not been claimed since.
+            logger.warning("Node liveness key had expired; restoring local presence entries")
+            await _restore_presence()
+
+
+async def _restore_presence():
+    pipe = _redis.pipeline(transaction=False)
+    for room_name, state in list(_rooms.items()):
+        for pid, username, avatar, active, record in zip(
+            state.peer_ids, state.usernames, state.avatars, state.active, state.records
+        ):
+            pipe.hsetnx(_presence_key(room_name), pid, _presence_meta(record.conn_id, username, avatar, active))
+    try:
+        await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Restoring presence failed: {e!r}")
+
+
+def _publish(room_name: str, payload: bytes, to: str | None = None, exclude: str | None = None):
+    if _redis is None:
+        return
+    header = orjson.dumps({"node": _NODE_ID, "to": to, "except": exclude})
+    try:
+        _publish_queue.put_nowait((_channel(room_name), header + b"\n" + payload))
+    except asyncio.QueueFull:
+        logger.warning(f"Redis publish queue full; dropping frame for room '{room_name}'")
+
+
+_PUBLISH_BATCH = 256
+
+
+async def _publisher():
+    """Publish queued frames in pipelined batches; queue order is kept within a batch."""
+    while True:
+        batch = [await _publish_queue.get()]
+        while len(batch) < _PUBLISH_BATCH and not _publish_queue.empty():
+            batch.append(_publish_queue.get_nowait())
+        pipe = _redis.pipeline(transaction=False)
+        for channel, data in batch:
+            pipe.publish(channel, data)
+        try:
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Redis publish of {len(batch)} frames failed: {e!r}")
+
+
+async def _consumer():
+    """Deliver frames published by other nodes to this node's local peers."""
+    prefix = len(_channel(""))
+    while True:
+        if not _pubsub.subscribed:
+            await asyncio.sleep(0.5)
+            continue
+        try:
+            message = await _pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+        except Exception as e:
+            logger.warning(f"Redis subscription read failed: {e!r}")
+            await asyncio.sleep(1.0)
+            continue
+        if message is None:
+            continue
+
+        try:
+            header, _, payload = message["data"].partition(b"\n")
+            envelope = orjson.loads(header)
+            if envelope["node"] == _NODE_ID:
+                continue
+            room_name = message["channel"].decode()[prefix:]
+            if envelope["to"]:
+                _deliver_local(room_name, envelope["to"], payload)
+            else:
+                _broadcast_local(room_name, envelope["except"], payload)
+        except Exception as e:
+            logger.warning(f"Dropping malformed backplane message on {message.get('channel')!r}: {e!r}")
+
+
+# Subscribe/unsubscribe calls are serialized and reconcile against _rooms at the
+# time they run, so a join racing the previous last leaver cannot end up with a
+# local peer in a room this node is no longer subscribed to.
+_subscription_lock = asyncio.Lock()
+_subscribed: set[str] = set()
+
+
+async def _sync_subscription(room_name: str):
+    """Subscribe to the room's channel iff this node has local peers in it."""
+    if _pubsub is None:
+        return
+    async with _subscription_lock:
+        wanted = room_name in _rooms
+        if wanted and room_name not in _subscribed:
+            await _pubsub.subscribe(_channel(room_name))
+            _subscribed.add(room_name)
+        elif not wanted and room_name in _subscribed:
+            await _pubsub.unsubscribe(_channel(room_name))
+            _subscribed.discard(room_name)
+
+
+async def _room_peers(room_name: str) -> list[dict]:
+    """Describe every peer currently in the room, for the "joined" message."""
+    if _redis is not None:
+        key = _presence_key(room_name)
+        members = {pid.decode(): orjson.loads(meta) for pid, meta in (await _redis.hgetall(key)).items()}
+        nodes = list({meta["node"] for meta in members.values()})
+        alive = set()
+        if nodes:
+            flags = await _redis.mget([_node_key(n) for n in nodes])
+            alive = {node for node, up in zip(nodes, flags) if up}
+
+        peers = []
+        dead = []
+        for pid, meta in members.items():
+            if meta["node"] not in alive:
+                dead.append((pid, meta["conn"]))
+                continue
+            peers.append({
+                "peerId": pid,
+                "username": meta["username"],
+                "avatarSeed": meta["avatarSeed"],
+                "isActive": meta["isActive"],
+            })
+        for pid, conn_id in dead:
+            await _presence_remove_script(keys=[key], args=[pid, conn_id])
+        return peers
+    state = _rooms.get(room_name)
+    return state.describe() if state else []
+
+
+def _presence_meta(conn_id: str, username: str, avatar_seed: str, is_active: bool) -> bytes:
+    return orjson.dumps({
+        "node": _NODE_ID,
+        "conn": conn_id,
+        "username": username,
+        "avatarSeed": avatar_seed,
+        "isActive": is_active,
+    })
+
+
+async def _presence_claim(room_name: str, peer_id: str, conn_id: str, username: str, avatar_seed: str, is_active: bool):
+    """Record this connection as the owner of peer_id's presence entry."""
+    if _redis is None:
+        return
+    key = _presence_key(room_name)
+    await _redis.hset(key, peer_id, _presence_meta(conn_id, username, avatar_seed, is_active))
+    await _redis.expire(key, _PRESENCE_TTL)
+
+
+async def _presence_update(room_name: str, peer_id: str, conn_id: str, username: str, avatar_seed: str, is_active: bool):
+    """Rewrite peer_id's presence entry if this connection still owns it."""
+    if _redis is None:
+        return
+    meta = _presence_meta(conn_id, username, avatar_seed, is_active)
+    await _presence_update_script(keys=[_presence_key(room_name)], args=[peer_id, conn_id, meta])
+
+
+async def _presence_remove(room_name: str, peer_id: str, conn_id: str) -> bool:
+    """Remove peer_id's presence entry if this connection owns it; True if it did."""
+    if _redis is None:
+        return True
+    return bool(await _presence_remove_script(keys=[_presence_key(room_name)], args=[peer_id, conn_id]))
+
+
+# ── Room metadata cache ────────────────────────────────────────────────────────
+# Rooms are write-once, so the hashed password can be served from RAM instead of
+# a SELECT on every join / existence check. Maps room_name -> (hashed_password or
+# None if the room does not exist, expiry timestamp). Misses get a shorter TTL so
+# a room created through another process becomes visible quickly. Size is capped,
+# evicting in insertion (FIFO) order, and expired entries are purged periodically.
+_ROOM_CACHE_TTL = 60.0
+_ROOM_MISS_TTL = 5.0
+_ROOM_CACHE_MAX = 10_000
+_room_cache: dict[str, tuple[str | None, float]] = {}
+
+
+async def _get_room(db: AsyncSession, room_name: str) -> str | None:
+    """Return the room's hashed password, or None if the room does not exist."""
+    cached = _room_cache.get(room_name)
+    if cached:
+        if cached[1] > time.time():
+            return cached[0]
+        del _room_cache[room_name]
+
+    # room_name is the primary key, so Session.get serves it from the identity
+    # map when already loaded and otherwise issues a cached PK lookup.
+    room = await db.get(Room, room_name)
+    hashed = room.hashed_password if room else None
+    ttl = _ROOM_CACHE_TTL if hashed is not None else _ROOM_MISS_TTL
+    _room_cache.pop(room_name, None)
+    while len(_room_cache) >= _ROOM_CACHE_MAX:
+        del _room_cache[next(iter(_room_cache))]
+    _room_cache[room_name] = (hashed, time.time() + ttl)
+    return hashed
+
+
+async def _purge_room_cache():
+    """Periodically drop expired room cache entries."""
+    while True:
+        await asyncio.sleep(_ROOM_CACHE_TTL)
+        now = time.time()
+        for name in [n for n, (_, expires) in _room_cache.items() if expires <= now]:
+            _room_cache.pop(name, None)
+
+
+# ── Input validation ───────────────────────────────────────────────────────────
+# Join fields are checked against these before any DB or bcrypt work, so junk
+# requests and connections cannot make us pay for a SELECT and a ~100ms hash compare.
+# The room pattern mirrors schemas.RoomCreate.
+_ROOM_RE = re.compile(r"[a-z0-9\-]{3,128}")
+_PEER_RE = re.compile(r"[A-Za-z0-9_\-]{8,128}")
 
 
 # ── REST endpoints ─────────────────────────────────────────────────────────────
 @app.post("/rooms", status_code=201)
 async def create_room(body: RoomCreate, db: AsyncSession = Depends(get_db)):
     """Create a room. Idempotent — if it already exists with the same password, returns 200."""
-    result = await db.execute(select(Room).where(Room.room_name == body.room_name))
-    existing = result.scalar_one_or_none()
+    existing = await db.get(Room, body.room_name)
     if existing:
-        if not verify_password(body.password, existing.hashed_password):
+        if not await verify_password(body.password, existing.hashed_password):
             raise HTTPException(status_code=409, detail="Room already exists with a different password.")
         return {"room_name": existing.room_name, "created": False}
 
     room = Room(
         room_name=body.room_name,
-        hashed_password=hash_password(body.password),
+        hashed_password=await hash_password(body.password),
     )
     db.add(room)
     await db.commit()
+    _room_cache.pop(body.room_name, None)
     logger.info(f"Room created: {body.room_name}")
     return {"room_name": room.room_name, "created": True}
 
 
 @app.get("/rooms/{room_name}", response_model=RoomResponse)
 async def check_room(room_name: str, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Room).where(Room.room_name == room_name))
-    room = result.scalar_one_or_none()
-    return {"room_name": room_name, "exists": room is not None}
+    if not _ROOM_RE.fullmatch(room_name):
+        return {"room_name": room_name, "exists": False}
+    hashed = await _get_room(db, room_name)
+    return {"room_name": room_name, "exists": hashed is not None}
+
+
+# ── Pre-encoded error frames ───────────────────────────────────────────────────
+_ERR_FORMAT = orjson.dumps({"type": "error", "message": "Invalid message format"})
+_ERR_JOIN_FIRST = orjson.dumps({"type": "error", "message": "First message must be type=join"})
+_ERR_NO_PEERID = orjson.dumps({"type": "error", "message": "peerId required"})
+_ERR_BAD_PEERID = orjson.dumps({"type": "error", "message": "Invalid peerId"})
+_ERR_BAD_AUTH = orjson.dumps({"type": "error", "message": "Invalid room or password"})
+_ERR_FULL = orjson.dumps({"type": "error", "message": "Room is full. Try again later."})
 
 
 # ── WebSocket signaling ────────────────────────────────────────────────────────
 @app.websocket("/ws/{room_name}")
-async def websocket_signaling(room_name: str, ws: WebSocket, db: AsyncSession = Depends(get_db)):
+async def websocket_signaling(room_name: str, ws: WebSocket):
+    # Closing before accept rejects the handshake with HTTP 403.
+    if not _allow_connection(ws.client.host if ws.client else ""):
+        await ws.close(code=1008)
+        return
+
     await ws.accept()
 
     # Step 1: Receive join message with password + peer identity
     try:
         raw = await ws.receive_text()
-        join_msg = json.loads(raw)
+        join_msg = orjson.loads(raw)
     except WebSocketDisconnect:
         return  # client disconnected before sending join — just exit
     except Exception:
-        await ws.send_text(json.dumps({"type": "error", "message": "Invalid message format"}))
+        await ws.send_bytes(_ERR_FORMAT)
         await ws.close(code=1003)
         return
 
-    if join_msg.get("type") != "join":
-        await ws.send_text(json.dumps({"type": "error", "message": "First message must be type=join"}))
+    if not isinstance(join_msg, dict) or join_msg.get("type") != "join":
+        await ws.send_bytes(_ERR_JOIN_FIRST)
         await ws.close(code=1008)
         return
 
@@ -119,76 +626,115 @@ async def websocket_signaling(room_name: str, ws: WebSocket, db: AsyncSession =
     avatar_seed = join_msg.get("avatarSeed", "")
 
     if not peer_id:
-        await ws.send_text(json.dumps({"type": "error", "message": "peerId required"}))
+        await ws.send_bytes(_ERR_NO_PEERID)
         await ws.close(code=1008)
         return
 
-    # Step 2: Verify room password
-    result = await db.execute(select(Room).where(Room.room_name == room_name))
-    room = result.scalar_one_or_none()
-    if not room or not verify_password(password, room.hashed_password):
-        await ws.send_text(json.dumps({"type": "error", "message": "Invalid room or password"}))
+    if not isinstance(peer_id, str) or not _PEER_RE.fullmatch(peer_id):
+        await ws.send_bytes(_ERR_BAD_PEERID)
         await ws.close(code=1008)
         return
 
-    # Step 3: Register peer in memory
-    if room_name not in rooms_registry:
-        rooms_registry[room_name] = {}
+    if (
+        not _ROOM_RE.fullmatch(room_name)
+        or not isinstance(password, str)
+        or len(password.encode()) > MAX_PASSWORD_BYTES
+    ):
+        await ws.send_bytes(_ERR_BAD_AUTH)
+        await ws.close(code=1008)
+        return
 
-    if len(rooms_registry.get(room_name, {})) >= 200:
-        await ws.send_text(json.dumps({"type": "error", "message": "Room is full. Try again later."}))
+    # Step 2: Verify room password. The DB session is scoped to the lookup only,
+    # so it goes back to the pool before the long-lived relay loop starts.
+    async with AsyncSessionLocal() as db:
+        hashed = await _get_room(db, room_name)
+    if hashed is None or not await _verify_join_password(room_name, password, hashed):
+        await ws.send_bytes(_ERR_BAD_AUTH)
         await ws.close(code=1008)
         return
 
-    existing_peers = [
-        {"peerId": pid, "username": data["username"], "avatarSeed": data["avatarSeed"], "isActive": data["isActive"]}
-        for pid, data in rooms_registry[room_name].items()
-    ]
+    # Step 3: Register peer in memory. A reconnecting peer may still be listed under
+    # its old connection; it is neither told about itself nor counted against the cap.
+    existing_peers = [p for p in await _room_peers(room_name) if p["peerId"] != peer_id]
+    if len(existing_peers) >= 200:
+        await ws.send_bytes(_ERR_FULL)
+        await ws.close(code=1008)
+        return
 
-    rooms_registry[room_name][peer_id] = {
-        "ws": ws,
-        "username": username,
-        "avatarSeed": avatar_seed,
-        "isActive": join_msg.get("isActive", True),
-    }
+    # Outbound frames go through a bounded per-peer queue drained by a writer task,
+    # so a slow receiver never blocks whoever is sending to it.
+    queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize=_PEER_QUEUE_SIZE)
 
-    # Step 4: Tell this peer about everyone already in the room
-    await ws.send_text(json.dumps({"type": "joined", "peers": existing_peers}))
+    # Step 4: Tell this peer about everyone already in the room (queued first so it
+    # is delivered ahead of anything relayed to this peer afterwards)
+    queue.put_nowait(orjson.dumps({"type": "joined", "peers": existing_peers}))
 
-    # Step 5: Tell existing peers about this new joiner
-    await _broadcast_to_room_except(room_name, peer_id, {
-        "type": "peer-joined",
-        "peerId": peer_id,
-        "username": username,
-        "avatarSeed": avatar_seed,
-        "isActive": join_msg.get("isActive", True),
-    })
+    is_active = join_msg.get("isActive", True)
+    peer = PeerRecord(
+        ws=ws,
+        queue=queue,
+        writer=asyncio.create_task(_peer_writer(ws, queue)),
+        bucket_ts=time.monotonic(),
+    )
+    _peers[(room_name, peer_id)] = peer
+    _rooms[room_name].add(peer_id, username, avatar_seed, is_active, peer)
 
-    logger.info(f"Peer {peer_id[:8]} joined room '{room_name}' (now {len(rooms_registry[room_name])} peers)")
+    # Relayed frames are forwarded as the client sent them, with this peer's identity
+    # spliced in before the closing brace. Duplicate keys resolve to the last one in
+    # JSON.parse, so a client cannot spoof "from" — and the (possibly large) SDP is
+    # never re-serialized. Built once per connection.
+    identity_suffix = b"," + orjson.dumps({"from": peer_id, "username": username, "avatarSeed": avatar_seed})[1:]
 
-    # Step 6: Relay signaling messages
+    # Everything from here on may fail (Redis calls included), so it runs inside the
+    # try whose finally removes the registration made above.
     try:
+        await _sync_subscription(room_name)
+        await _presence_claim(room_name, peer_id, peer.conn_id, username, avatar_seed, is_active)
+
+        # Step 5: Tell existing peers about this new joiner
+        _broadcast_to_room_except(room_name, peer_id, {
+            "type": "peer-joined",
+            "peerId": peer_id,
+            "username": username,
+            "avatarSeed": avatar_seed,
+            "isActive": is_active,
+        })
+
+        logger.info(f"Peer {peer_id[:8]} joined room '{room_name}' (now {len(existing_peers) + 1} peers)")
+
+        # Step 6: Relay signaling messages
         while True:
             raw = await ws.receive_text()
+
+            now = time.monotonic()
+            peer.bucket_tokens = min(_PEER_BURST, peer.bucket_tokens + (now - peer.bucket_ts) * _PEER_RATE) - 1
+            peer.bucket_ts = now
+            if peer.bucket_tokens < 0:
+                logger.info(f"Peer {peer_id[:8]} in room '{room_name}' exceeded the message rate; disconnecting")
+                await ws.close(code=1008)
+                break
+
             try:
-                msg = json.loads(raw)
+                msg = orjson.loads(raw)
             except Exception:
                 continue
+            # Relays are spliced into the raw text as an object, so anything else is dropped.
+            if not isinstance(msg, dict):
+                continue
 
             msg_type = msg.get("type")
             target_id = msg.get("to")
 
             # We route offer/answer/ice-candidate
-            if msg_type in ("offer", "answer", "ice-candidate") and target_id:
-                msg["from"] = peer_id
-                msg["username"] = username
-                msg["avatarSeed"] = avatar_seed
-                await _send_to_peer(room_name, target_id, msg)
+            if msg_type in ("offer", "answer", "ice-candidate") and target_id and isinstance(target_id, str):
+                frame = raw.rstrip()[:-1].encode() + identity_suffix
+                await _send_to_peer(room_name, target_id, frame)
                 
             elif msg_type == "status" and "isActive" in msg:
-                if peer_id in rooms_registry.get(room_name, {}):
-                    rooms_registry[room_name][peer_id]["isActive"] = msg["isActive"]
-                    await _broadcast_to_room_except(room_name, peer_id, {
+                if _peers.get((room_name, peer_id)) is peer:
+                    _rooms[room_name].set_active(peer_id, msg["isActive"])
+                    await _presence_update(room_name, peer_id, peer.conn_id, username, avatar_seed, msg["isActive"])
+                    _broadcast_to_room_except(room_name, peer_id, {
                         "type": "peer-status",
                         "peerId": peer_id,
                         "isActive": msg["isActive"]
@@ -197,34 +743,93 @@ async def websocket_signaling(room_name: str, ws: WebSocket, db: AsyncSession =
     except WebSocketDisconnect:
         pass
     finally:
-        # Step 7: Drop all in-memory state for this peer
-        rooms_registry.get(room_name, {}).pop(peer_id, None)
-        if not rooms_registry.get(room_name):
-            rooms_registry.pop(room_name, None)
-
-        await _broadcast_to_room_except(room_name, peer_id, {
-            "type": "peer-left",
-            "peerId": peer_id,
-        })
+        # Step 7: Drop all in-memory state for this peer (unless a newer connection
+        # with the same peerId has already replaced it, here or on another node)
+        peer.writer.cancel()
+        if _peers.get((room_name, peer_id)) is peer:
+            del _peers[(room_name, peer_id)]
+            state = _rooms[room_name]
+            state.remove(peer_id)
+            room_empty = not state.peer_ids
+            if room_empty:
+                del _rooms[room_name]
+            still_owner = True
+            try:
+                if room_empty:
+                    await _sync_subscription(room_name)
+                still_owner = await _presence_remove(room_name, peer_id, peer.conn_id)
+            except Exception as e:
+                logger.warning(f"Redis cleanup for peer {peer_id[:8]} in room '{room_name}' failed: {e!r}")
+
+            if still_owner:
+                _broadcast_to_room_except(room_name, peer_id, {
+                    "type": "peer-left",
+                    "peerId": peer_id,
+                })
         logger.info(f"Peer {peer_id[:8]} left room '{room_name}'")
 
 
 # ── Helpers ────────────────────────────────────────────────────────────────────
-async def _send_to_peer(room_name: str, peer_id: str, msg: dict):
-    peer = rooms_registry.get(room_name, {}).get(peer_id)
-    if peer:
-        try:
-            await peer["ws"].send_text(json.dumps(msg))
-        except Exception:
-            pass
+async def _peer_writer(ws: WebSocket, queue: asyncio.Queue):
+    """Drain a peer's outbound queue onto its socket until the socket fails."""
+    try:
+        while True:
+            payload = await queue.get()
+            await ws.send_bytes(payload)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        pass  # socket is gone — the peer's receive loop handles cleanup
 
 
-async def _broadcast_to_room_except(room_name: str, exclude_peer_id: str, msg: dict):
-    room = rooms_registry.get(room_name, {})
-    text = json.dumps(msg)
-    for pid, data in list(room.items()):
+async def _close_quietly(ws: WebSocket, code: int):
+    try:
+        await ws.close(code=code)
+    except Exception:
+        pass
+
+
+def _enqueue(room_name: str, peer_id: str, peer: PeerRecord, payload: bytes):
+    if peer.closing:
+        return
+    try:
+        peer.queue.put_nowait(payload)
+    except asyncio.QueueFull:
+        # The peer is not keeping up; drop it rather than buffer without bound.
+        logger.info(f"Peer {peer_id[:8]} in room '{room_name}' fell behind; disconnecting")
+        peer.closing = True
+        peer.writer.cancel()
+        peer.close_task = asyncio.create_task(_close_quietly(peer.ws, 1013))
+
+
+def _deliver_local(room_name: str, peer_id: str, payload: bytes) -> bool:
+    peer = _peers.get((room_name, peer_id))
+    if peer is None:
+        return False
+    _enqueue(room_name, peer_id, peer, payload)
+    return True
+
+
+def _broadcast_local(room_name: str, exclude_peer_id: str | None, payload: bytes):
+    state = _rooms.get(room_name)
+    if state is None:
+        return
+    for pid, record in list(zip(state.peer_ids, state.records)):
         if pid != exclude_peer_id:
-            try:
-                await data["ws"].send_text(text)
-            except Exception:
-                pass
+            _enqueue(room_name, pid, record, payload)
+
+
+async def _send_to_peer(room_name: str, peer_id: str, payload: bytes):
+    if _deliver_local(room_name, peer_id, payload):
+        return
+    # Only publish for peers that are actually in the room on some node, so
+    # frames addressed to made-up ids cannot crowd the shared publish queue.
+    if _redis is not None and await _redis.hexists(_presence_key(room_name), peer_id):
+        _publish(room_name, payload, to=peer_id)
+
+
+def _broadcast_to_room_except(room_name: str, exclude_peer_id: str, msg: dict):
+    # Serialize once; each peer's writer task sends the same bytes object.
+    payload = orjson.dumps(msg)
+    _broadcast_local(room_name, exclude_peer_id, payload)
+    _publish(room_name, payload, exclude=exclude_peer_id)
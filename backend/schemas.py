@@ -1,10 +1,20 @@
 """schemas.py — Pydantic request/response models"""
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
+
+# bcrypt rejects (or, in older releases, silently truncates) input past 72 bytes.
+MAX_PASSWORD_BYTES = 72
 
 
 class RoomCreate(BaseModel):
     room_name: str = Field(..., min_length=3, max_length=128, pattern=r'^[a-z0-9\-]+$')
-    password: str = Field(..., min_length=8, max_length=128)
+    password: str = Field(..., min_length=8, max_length=MAX_PASSWORD_BYTES)
+
+    @field_validator("password")
+    @classmethod
+    def password_fits_bcrypt(cls, v: str) -> str:
+        if len(v.encode()) > MAX_PASSWORD_BYTES:
+            raise ValueError(f"Password must be at most {MAX_PASSWORD_BYTES} bytes when UTF-8 encoded.")
+        return v
 
 
 class RoomResponse(BaseModel):
@@ -0,0 +1,34 @@
+"""calibrate_bcrypt.py — Pick a bcrypt cost factor for this host
+
+Times one hash at each cost in 10..15 and prints the cost whose duration is
+closest to the target (default 250ms). Set the result as BCRYPT_ROUNDS.
+
+Usage:
+    python scripts/calibrate_bcrypt.py [target_ms]
+"""
+import sys
+import time
+
+import bcrypt
+
+
+def time_hash_ms(rounds: int) -> float:
+    start = time.perf_counter()
+    bcrypt.hashpw(b"x" * 8, bcrypt.gensalt(rounds=rounds))
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    target_ms = float(sys.argv[1]) if len(sys.argv) > 1 else 250.0
+
+    timings = {}
+    for rounds in range(10, 16):
+        timings[rounds] = time_hash_ms(rounds)
+        print(f"rounds={rounds:2d}  {timings[rounds]:8.1f} ms")
+
+    best = min(timings, key=lambda r: abs(timings[r] - target_ms))
+    print(f"\nClosest to {target_ms:.0f}ms: BCRYPT_ROUNDS={best} ({timings[best]:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ import { useEffect, useRef, useCallback } from 'react'
 import { useWebRTC } from '../hooks/useWebRTC'
 
 const WS_BASE = import.meta.env.VITE_WS_URL || 'ws://localhost:8000'
+const textDecoder = new TextDecoder()
 
 export default function RoomConnection({
     roomName,
@@ -92,6 +93,7 @@ export default function RoomConnection({
         onPeersUpdate(roomName, () => []) // clear peers on reconnect
 
         const ws = new WebSocket(`${WS_BASE}/ws/${roomName}`)
+        ws.binaryType = 'arraybuffer'
         wsRef.current = ws
 
         const timeout = setTimeout(() => {
@@ -114,8 +116,10 @@ export default function RoomConnection({
         }
 
         ws.onmessage = async (evt) => {
+            // The server sends JSON as binary frames (pre-encoded bytes) or text
+            const text = typeof evt.data === 'string' ? evt.data : textDecoder.decode(evt.data)
             let msg
-            try { msg = JSON.parse(evt.data) } catch { return }
+            try { msg = JSON.parse(text) } catch { return }
 
             switch (msg.type) {
                 case 'joined': {
@@ -57,7 +57,8 @@ export default function Sidebar({
         if (r.length > 128) return 'Room name must be 128 characters or fewer.'
         if (!ROOM_PATTERN.test(r)) return 'Room name can only contain lowercase letters, numbers, and hyphens.'
         if (p.length < 8) return 'Password must be at least 8 characters.'
-        if (p.length > 128) return 'Password must be 128 characters or fewer.'
+        // bcrypt only accepts 72 bytes, so the limit is on the UTF-8 encoding
+        if (new TextEncoder().encode(p).length > 72) return 'Password must be 72 bytes or fewer (72 plain ASCII characters).'
         return ''
     }
 
@@ -215,7 +216,7 @@ export default function Sidebar({
                                 placeholder="password"
                                 type={showPassword ? "text" : "password"}
                                 value={passInput}
-                                maxLength={128}
+                                maxLength={72}
                                 onChange={e => { setPassInput(e.target.value); setFormError('') }} />
                             <button
                                 type="button"